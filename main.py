@@ -1,54 +1,120 @@
+import io
 import os
 import re
+import csv
 import json
+import hashlib
+import shutil
+import functools
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- libs externas ---
+# pandas, tabula y gspread se importan dentro de las funciones que los usan:
+# así no se pagan (ni se sondea la JVM) cuando no hacen falta
 import pdfplumber          # pip install pdfplumber
-import tabula              # pip install tabula-py (requiere Java)
-import gspread
-from google.oauth2.service_account import Credentials
+try:
+    import fitz            # pip install pymupdf (opcional, extracción en C mucho más rápida)
+except ImportError:
+    fitz = None
+try:
+    import orjson          # pip install orjson (opcional, parseo JSON más rápido)
+except ImportError:
+    orjson = None
 
 # =================== CONFIG ===================
 PDF_URL = "https://quimicacromax.com.ar/lista-de-precios.pdf"
 SPREADSHEET_ID = "1zEe-kSeaygPG8QwFY3OoUYg0YYEwLOBg9U3BnNUCa6Y"
 SHEET_NAME = "LISTA_PROVEEDOR"
+# ETag/Last-Modified/sha256 del último PDF publicado (persistido entre corridas con actions/cache)
+PDF_CACHE_PATH = os.path.join(os.getenv("GITHUB_WORKSPACE", os.getcwd()), "pdf_cache.json")
+# FORCE_REFRESH=1 ignora esa metadata: re-parsea y reescribe aunque el PDF no haya cambiado
+FORCE_REFRESH = os.getenv("FORCE_REFRESH", "").strip().lower() in ("1", "true", "yes")
+COLUMNS = ["codigo", "descripcion", "presentacion", "precio_final"]
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
     "https://www.googleapis.com/auth/drive",
 ]
 
+# sesión HTTP reutilizable (pool de conexiones + reintentos)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5),
+))
+
 # =================== REGEX / REGLAS =====================
-CODE_RE  = re.compile(r"^\d{2,6}$")  # 2 a 6 dígitos
+CODE_RE  = re.compile(r"^\d{2,6}$", re.A)  # 2 a 6 dígitos (ASCII: "１２３" no es código)
 LETTERS  = re.compile(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ]")
-PRICE_RE = re.compile(r"^\$?\s*\d{1,3}(?:[.\s]\d{3})*(?:,\d{2})?$|^\$?\s*\d+(?:[.,]\d{2})?$")
+PRICE_RE = re.compile(r"^\$?\s*\d{1,3}(?:[.\s]\d{3})*(?:,\d{2})?$|^\$?\s*\d+(?:[.,]\d{2})?$", re.A)
+XU_RE    = re.compile(r"x\s*\d+\s*u\b", re.I)  # "x5u"
+WS_RE    = re.compile(r"\s+")
+NONDIGIT_RE  = re.compile(r"[^\d.]")
+PRICE_SPLIT_RE = re.compile(r"^(?:(\d{1,3}(?:\.\d{3})+)|(\d+(?:[.,]\d{2})?))$")  # miles | simple
+THOUSANDS_PAT = r"\d{1,3}(?:\.\d{3})+"  # para .str.fullmatch en pandas (ver is_thousands)
+UNIT_RE  = re.compile(r"\b(\d{1,4})\s*(ml|cc|l|lt|lts|litro?s?|kg|g)\b", re.I)
+DOT00_RE = re.compile(r"\s+[.,]00\b")
+# código o precio en un solo match: el grupo que matchea (lastgroup) dice cuál es
+TOKEN_RE = re.compile(
+    r"^(?:(?P<code>\d{2,6})"
+    r"|(?P<price>\$?\s*\d{1,3}(?:[.\s]\d{3})*(?:,\d{2})?|\$?\s*\d+(?:[.,]\d{2})?))$",
+    re.A,  # como CODE_RE/PRICE_RE: classify() y classify_frame() deben aceptar los mismos tokens
+)
 SKIP_WORDS = (
     "fecha", "hora", "página", "pag", "cliente", "subtotal",
     "total", "cuit", "c.u.i.t", "condición", "condicion",
     "responsable", "inscripto", "domicilio", "original"
 )
+SKIP_RE = re.compile("|".join(re.escape(w) for w in SKIP_WORDS), re.I)
+PRICE_START = "$0123456789"
 
+
+# memo por token: las listas repiten muchísimo los mismos textos
+# (palabras del PDF y encabezados de tabula, siempre str; las celdas van por tidy_column)
+@functools.lru_cache(maxsize=8192)
 def tidy_text(s):
     if s is None:
         return ""
-    s = str(s).replace("\n", " ")
-    s = re.sub(r"x\s*\d+\s*u\b", "", s, flags=re.I)  # quita "x5u"
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
+    s = str(s)
+    # camino rápido: la mayoría de las palabras no tienen "x" ni espacios raros
+    if "x" in s or "X" in s:
+        s = XU_RE.sub("", s)  # quita "x5u"
+    if "  " in s or not s.isprintable():  # \n, \t, \xa0, etc. no son printable
+        s = WS_RE.sub(" ", s)
+    return s.strip()
+
+@functools.lru_cache(maxsize=8192)
 def has_letters(s): return bool(LETTERS.search(s or ""))
 
-def is_price_token(tok): return bool(PRICE_RE.match((tok or "").strip()))
+def is_thousands(s):
+    # equivale a ^\d{1,3}(?:\.\d{3})+$ pero con operaciones de str
+    if "," in s or "." not in s:
+        return False
+    head, *rest = s.split(".")
+    return 1 <= len(head) <= 3 and head.isdecimal() and all(len(p) == 3 and p.isdecimal() for p in rest)
 
+# classify_frame() repite esta lógica vectorizada para tabula: cualquier cambio acá va también allá
+@functools.lru_cache(maxsize=8192)
 def to_price(tok):
-    s = (tok or "").strip().replace(" ", "")
-    if re.match(r"^\d{1,3}(?:\.\d{3})+$", s):
+    s = (tok or "").strip()
+    if not s or s[0] not in PRICE_START:
+        return None
+    m = PRICE_SPLIT_RE.match(s)
+    if m:
+        # camino común, un solo match: "1.234" (miles) o "1234" / "12,50" / "12.50"
+        thousands, plain = m.group(1), m.group(2)
+        v = float(thousands.replace(".", "") if thousands else plain.replace(",", "."))
+        return v if v >= 1 else None
+
+    s = s.replace(" ", "")
+    if is_thousands(s):
         s = s.replace(".", "")
     s = s.replace(",", ".")
-    s = re.sub(r"[^\d.]", "", s)
+    s = NONDIGIT_RE.sub("", s)
     if not s: return None
     try:
         v = float(s)
@@ -56,40 +122,210 @@ def to_price(tok):
     except Exception:
         return None
 
+@functools.lru_cache(maxsize=8192)
 def extract_unit(desc):
-    m = re.search(r"\b(\d{1,4})\s*(ml|cc|l|lt|lts|litro?s?|kg|g)\b", desc, re.I)
+    m = UNIT_RE.search(desc)
     if not m: return ""
     n, u = m.group(1), m.group(2).lower()
     if u in ("l", "lt", "lts") or u.startswith("litro"): u = "lt"
     return f"{n} {u}"
 
+# tipos de token: OTHER (ni letras ni precio), CODE (código y a la vez precio), TEXT, PRICE
+T_OTHER, T_CODE, T_TEXT, T_PRICE = 0, 1, 2, 3
+
+@functools.lru_cache(maxsize=8192)
+def classify(tok):
+    """Devuelve (tipo, precio) para un token en una sola pasada."""
+    if has_letters(tok):
+        return T_TEXT, None
+    t = (tok or "").strip()
+    if not t or t[0] not in PRICE_START:
+        return T_OTHER, None
+    m = TOKEN_RE.match(t)
+    if not m:
+        return T_OTHER, None
+    kind = T_CODE if m.lastgroup == "code" else T_PRICE
+    return kind, to_price(tok)
+
+def classify_tokens(toks):
+    # map + zip en C sobre el classify() cacheado: una consulta de dict por token repetido
+    if not toks:
+        return (), ()
+    kinds, vals = zip(*map(classify, toks))
+    return kinds, vals
+
 def load_creds():
+    from google.oauth2.service_account import Credentials
     sa_json = os.environ.get("GOOGLE_SERVICE_ACCOUNT_JSON", "").strip()
     if not sa_json:
         raise SystemExit("[ERROR] Falta el secreto GOOGLE_SERVICE_ACCOUNT_JSON")
-    info = json.loads(sa_json)
+    info = orjson.loads(sa_json) if orjson is not None else json.loads(sa_json)
     return Credentials.from_service_account_info(info, scopes=SCOPES)
 
-def download_pdf(path):
+def load_pdf_cache():
+    try:
+        with open(PDF_CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_pdf_cache(meta):
+    with open(PDF_CACHE_PATH, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+def download_pdf():
+    """
+    Descarga el PDF a memoria con GET condicional (ETag / Last-Modified).
+    Devuelve (pdf_bytes, metadata), o None si la lista no cambió desde la última corrida OK.
+    """
     print(f"[INFO] Descargando PDF: {PDF_URL}")
-    r = requests.get(PDF_URL, timeout=60)
-    r.raise_for_status()
-    with open(path, "wb") as f:
-        f.write(r.content)
+    if FORCE_REFRESH:
+        print("[INFO] FORCE_REFRESH: se ignora la metadata de la última corrida")
+    cached = {} if FORCE_REFRESH else load_pdf_cache()
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    with _SESSION.get(PDF_URL, headers=headers, timeout=60, stream=True) as r:
+        if r.status_code == 304:
+            print("[INFO] PDF sin cambios (304 Not Modified)")
+            return None
+        r.raise_for_status()
+        r.raw.decode_content = True  # respeta Content-Encoding (gzip, etc.)
+        buf = io.BytesIO()
+        shutil.copyfileobj(r.raw, buf, length=1 << 16)
+        meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    pdf_bytes = buf.getvalue()
+    meta["sha256"] = hashlib.sha256(pdf_bytes).hexdigest()
     print("[INFO] PDF descargado OK")
 
-# =================== pdfplumber ===================
-def page_lines(page, y_tol=3.5):
-    words = page.extract_words(
-        keep_blank_chars=False,
-        use_text_flow=False,
-        extra_attrs=["x0", "x1", "top", "bottom"]
-    )
-    words.sort(key=lambda w: (w["top"], w["x0"]))
+    # el servidor puede no soportar GET condicional: comparo también el contenido
+    if cached.get("sha256") == meta["sha256"]:
+        print("[INFO] PDF idéntico al de la última corrida")
+        return None
+    return pdf_bytes, meta
+
+# =================== Armado de filas ===================
+def assemble_rows(lines, carry=(None, 999)):
+    """
+    Arma filas [code, desc, unit, price] a partir de líneas ya clasificadas
+    (toks, kinds, vals, code_in_line) de una misma página/tabla; None = línea salteada.
+    `carry` es el (last_code, last_code_age) con el que arranca; se devuelve el final.
+    """
+    rows = []
+    merged = 0
+    carried_codes = 0
+
+    # “arrastre” de código y pendiente de descripción
+    last_code, last_code_age = carry
+    pending = None  # (code, desc, unit)
+
+    for line in lines:
+        if line is None:
+            last_code_age += 1
+            continue
+        toks, kinds, vals, code_in_line = line
+
+        # Detectar si es una línea "sólo código"
+        only_code_line = (
+            code_in_line and
+            all(k == T_OTHER or t == code_in_line for t, k in zip(toks, kinds))
+        )
+        if only_code_line:
+            last_code, last_code_age = code_in_line, 0
+            pending = None
+            continue
+
+        # Descripción (tokens con letras; el código nunca las tiene)
+        desc = " ".join(t for t, k in zip(toks, kinds) if k == T_TEXT).strip()
+
+        # Números en la línea
+        nums_idx = [(i, v) for i, v in enumerate(vals) if v is not None]
+
+        # Código efectivo: en la línea o arrastrado de una línea previa cercana
+        code = code_in_line
+        if not code and last_code is not None and last_code_age <= 2 and desc:
+            code = last_code
+            carried_codes += 1
+
+        if desc and nums_idx and code:
+            # Caso A: desc+precio en la misma línea → precio = último número
+            unit = extract_unit(desc)
+            desc = DOT00_RE.sub("", desc)
+            price = nums_idx[-1][1]
+            rows.append([code, desc, unit, int(round(price))])
+            pending = None
+
+        elif desc and not nums_idx and code:
+            # Caso B: desc sin números → queda pendiente
+            unit = extract_unit(desc)
+            desc = DOT00_RE.sub("", desc)
+            pending = (code, desc, unit)
+
+        elif (not desc) and nums_idx and pending:
+            # Caso C: línea sólo números después de una desc pendiente → primer número
+            price = nums_idx[0][1]
+            pcode, pdesc, punit = pending
+            rows.append([pcode, pdesc, punit, int(round(price))])
+            pending = None
+            merged += 1
+
+        else:
+            pending = None  # línea basura / no usable
+
+        last_code_age += 1 if last_code is not None else 999
+
+    return rows, merged, carried_codes, (last_code, last_code_age)
+
+# =================== pdfplumber / PyMuPDF ===================
+def plumber_words(page, x_tol=3, y_tol=3):
+    """
+    Arma las palabras directamente desde page.chars (sin el paso de extract_words):
+    agrupa caracteres por renglón y une los contiguos (separación <= x_tol).
+    """
+    chars = sorted(page.chars, key=lambda c: c["top"])
+    rows, current, cur_top = [], [], None
+    for c in chars:
+        if cur_top is None or c["top"] - cur_top <= y_tol:
+            current.append(c); cur_top = c["top"] if cur_top is None else cur_top
+        else:
+            rows.append(current)
+            current, cur_top = [c], c["top"]
+    if current: rows.append(current)
+
+    words = []
+    for row in rows:
+        w = None
+        for c in sorted(row, key=lambda c: c["x0"]):
+            if c["text"].isspace():
+                w = None
+                continue
+            if w is not None and c["x0"] - w["x1"] <= x_tol:
+                w["text"] += c["text"]
+                w["x1"] = max(w["x1"], c["x1"])
+                w["bottom"] = max(w["bottom"], c["bottom"])
+            else:
+                w = {"text": c["text"], "x0": c["x0"], "x1": c["x1"], "top": c["top"], "bottom": c["bottom"]}
+                words.append(w)
+    return words
+
+def fitz_words(page):
+    # (x0, y0, x1, y1, text, block, line, word) → mismo formato que pdfplumber
+    return [{"text": w[4], "x0": w[0], "x1": w[2], "top": w[1], "bottom": w[3]}
+            for w in page.get_text("words")]
+
+def page_lines(words, y_tol=3.5):
+    import numpy as np
+    # orden por "top" en C (argsort estable sobre floats) en vez de comparar dicts en Python
+    tops = np.fromiter((w["top"] for w in words), dtype=float, count=len(words))
+    order = np.argsort(tops, kind="stable").tolist()
 
     lines, current, cur_top = [], [], None
-    for w in words:
-        if cur_top is None or abs(w["top"] - cur_top) <= y_tol:
+    for i in order:
+        w = words[i]
+        if cur_top is None or w["top"] - cur_top <= y_tol:
             current.append(w); cur_top = w["top"] if cur_top is None else cur_top
         else:
             lines.append(sorted(current, key=lambda x: x["x0"]))
@@ -103,127 +339,162 @@ def page_lines(page, y_tol=3.5):
         out.append((toks, xs))
     return out
 
-def parse_pdfplumber(pdf_path):
-    rows = []
-    merged = 0
-    carried_codes = 0
-    total_lines = 0
+def quantities(toks, vals):
+    """Marca los números que son cantidad de la descripción ("500" en "500 ml"): no son código ni precio."""
+    return [v is not None and i + 1 < len(toks) and UNIT_RE.match(f"{toks[i]} {toks[i + 1]}") is not None
+            for i, v in enumerate(vals)]
+
+def desc_span(kinds, vals, qty, code_idx):
+    """
+    (inicio, fin) de la descripción a unir en un solo token: del token siguiente al código hasta
+    la última palabra con letras antes del precio final. PyMuPDF/pdfminer cortan "Jabón 500 ml"
+    en palabras sueltas; unidas quedan como la celda de tabula y el "500" no se toma como precio
+    ni se pierde para extract_unit(). None si no hay nada que unir.
+    """
+    n = len(kinds)
+    # precio final: el último número que no sea el código ni una cantidad ("UNIDAD", "c/u" detrás quedan afuera)
+    price_idx = next((i for i in range(n - 1, -1, -1) if vals[i] is not None and i != code_idx and not qty[i]), n)
+    text = [i for i in range(price_idx) if kinds[i] == T_TEXT]
+    if not text:
+        return None
+    end = text[-1] + 1
+    start = code_idx + 1 if code_idx is not None and code_idx < end else text[0]
+    if all(k == T_TEXT for k in kinds[start:end]):
+        return None
+    return start, end
 
-    # “arrastre” de código y pendiente de descripción
-    last_code, last_code_age = None, 999
-    pending = None  # (code, desc, unit)
+def plumber_line(toks, xs):
+    """Clasifica una línea de pdfplumber/PyMuPDF; None si es encabezado/pie a saltear."""
+    if SKIP_RE.search(" ".join(toks)):
+        return None
+    kinds, vals = classify_tokens(toks)
+    qty = quantities(toks, vals)
+
+    # Detectar código por el token más a la izquierda que cumpla CODE_RE (una cantidad no es código)
+    code_idx = min((i for i, k in enumerate(kinds) if k == T_CODE and not qty[i]), key=xs.__getitem__, default=None)
+
+    span = desc_span(kinds, vals, qty, code_idx)
+    if span is not None:
+        a, b = span
+        toks = toks[:a] + [" ".join(t for t in toks[a:b] if t)] + toks[b:]
+        kinds, vals = classify_tokens(toks)
+        if code_idx is not None and code_idx >= b:
+            code_idx -= b - a - 1
+    code_in_line = toks[code_idx] if code_idx is not None else ""
+    return toks, kinds, vals, code_in_line
+
+def parse_page(words):
+    """Procesa las palabras de una página; el arrastre de código y la desc pendiente no cruzan páginas."""
+    lines = page_lines(words)
+    rows, merged, carried_codes, _ = assemble_rows(plumber_line(toks, xs) for toks, xs in lines)
+    return rows, (len(lines), merged, carried_codes)
+
+def open_fitz(pdf_bytes):
+    return fitz.open(stream=pdf_bytes, filetype="pdf")
+
+_WORKER_PDF = None  # bytes del PDF en cada proceso del pool (se mandan una vez, no por página)
+
+def _init_worker(pdf_bytes):
+    global _WORKER_PDF
+    _WORKER_PDF = pdf_bytes
+
+def _parse_page_number(page_number, pdf_bytes=None):
+    # top-level para que sea picklable por ProcessPoolExecutor
+    pdf_bytes = _WORKER_PDF if pdf_bytes is None else pdf_bytes
+    with pdfplumber.open(io.BytesIO(pdf_bytes), pages=[page_number]) as pdf:
+        return parse_page(plumber_words(pdf.pages[0]))
+
+def count_pages(pdf_bytes):
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return len(pdf.pages)
+
+def parse_pdfplumber(pdf_bytes):
+    if fitz is not None:
+        # PyMuPDF extrae en C (milisegundos por página): un solo documento abierto, sin pool
+        with open_fitz(pdf_bytes) as doc:
+            results = [parse_page(fitz_words(page)) for page in doc]
+    else:
+        n_pages = count_pages(pdf_bytes)
+        page_numbers = range(1, n_pages + 1)
+
+        # pdfminer es Python puro y atado al GIL → procesos, no threads
+        workers = min(n_pages, os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(pdf_bytes,)) as ex:
+                results = list(ex.map(_parse_page_number, page_numbers))
+        else:
+            results = [_parse_page_number(n, pdf_bytes) for n in page_numbers]
+
+    rows = []
+    total_lines = merged = carried_codes = 0
+    for page_rows, (n_lines, n_merged, n_carried) in results:
+        rows += page_rows
+        total_lines += n_lines
+        merged += n_merged
+        carried_codes += n_carried
 
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            pending = None
-            last_code, last_code_age = None, 999
-
-            for toks, xs in page_lines(page):
-                total_lines += 1
-                if any(sw in " ".join(toks).lower() for sw in SKIP_WORDS): 
-                    last_code_age += 1
-                    continue
-
-                # Detectar código por el token más a la izquierda que cumpla CODE_RE
-                code_idx = None
-                for i, t in enumerate(toks):
-                    if CODE_RE.match(t):
-                        if code_idx is None or xs[i] < xs[code_idx]:
-                            code_idx = i
-                code_in_line = toks[code_idx] if code_idx is not None else ""
-
-                # Detectar si es una línea "sólo código"
-                only_code_line = (
-                    code_in_line and
-                    all((not has_letters(t) and not is_price_token(t)) or t == code_in_line for t in toks)
-                )
-                if only_code_line:
-                    last_code, last_code_age = code_in_line, 0
-                    pending = None
-                    continue
-
-                # Descripción (tokens con letras, excluyendo el token exacto de código)
-                desc_tokens = []
-                for i, t in enumerate(toks):
-                    if code_idx is not None and i == code_idx:
-                        continue
-                    if has_letters(t):
-                        desc_tokens.append(t)
-                desc = " ".join(desc_tokens).strip()
-
-                # Números en la línea
-                nums_idx = [(i, to_price(toks[i])) for i in range(len(toks)) if is_price_token(toks[i])]
-                nums_idx = [(i, v) for i, v in nums_idx if v is not None]
-
-                # Código efectivo: en la línea o arrastrado de una línea previa cercana
-                code = code_in_line
-                if not code and last_code is not None and last_code_age <= 2 and desc:
-                    code = last_code
-                    carried_codes += 1
-
-                if desc and nums_idx and code:
-                    # Caso A: desc+precio en la misma línea → precio = último número
-                    unit = extract_unit(desc)
-                    desc = re.sub(r"\s+[.,]00\b", "", desc)
-                    price = nums_idx[-1][1]
-                    rows.append([code, desc, unit, int(round(price))])
-                    pending = None
-
-                elif desc and not nums_idx and code:
-                    # Caso B: desc sin números → queda pendiente
-                    unit = extract_unit(desc)
-                    desc = re.sub(r"\s+[.,]00\b", "", desc)
-                    pending = (code, desc, unit)
-
-                elif (not desc) and nums_idx and pending:
-                    # Caso C: línea sólo números después de una desc pendiente → primer número
-                    price = nums_idx[0][1]
-                    pcode, pdesc, punit = pending
-                    rows.append([pcode, pdesc, punit, int(round(price))])
-                    pending = None
-                    merged += 1
-
-                else:
-                    pending = None  # línea basura / no usable
-
-                last_code_age += 1 if last_code is not None else 999
-
-    # dedupe por (code, desc) manteniendo el último precio visto
-    dedup = {}
-    for code, desc, unit, price in rows:
-        dedup[(code, desc)] = [code, desc, unit, price]
-    rows = list(dedup.values())
     print(f"[INFO] pdfplumber: lineas={total_lines}, items={len(rows)}, fusionadas={merged}, codigos_arrastrados={carried_codes}")
     return rows
 
 # =================== Tabula (fallback) ===================
+def tidy_column(col):
+    """tidy_text() vectorizado para una columna entera; las celdas vacías (NaN/None) quedan como ""."""
+    s = col.astype("string").fillna("")
+    s = s.str.replace(XU_RE, "", regex=True).str.replace(WS_RE, " ", regex=True).str.strip()
+    return s.astype(object)
+
 def read_all_tables(pdf_path):
+    import pandas as pd
+    import tabula          # pip install tabula-py (requiere Java)
+    # cada read_pdf levanta una JVM nueva: stream sólo si lattice no encontró nada
     dfs = []
     try:
-        dfs += tabula.read_pdf(pdf_path, pages="all", lattice=True, multiple_tables=True)
+        dfs += tabula.read_pdf(pdf_path, pages="all", lattice=True, multiple_tables=True, silent=True)
     except Exception as e:
         print("[WARN] Lattice failed:", e)
-    try:
-        dfs += tabula.read_pdf(pdf_path, pages="all", stream=True, multiple_tables=True, guess=True)
-    except Exception as e:
-        print("[WARN] Stream failed:", e)
+    if sum(getattr(df, "size", 0) for df in dfs) == 0:
+        try:
+            dfs += tabula.read_pdf(pdf_path, pages="all", stream=True, multiple_tables=True, guess=True, silent=True)
+        except Exception as e:
+            print("[WARN] Stream failed:", e)
     clean = []
     for df in dfs:
         if isinstance(df, pd.DataFrame) and df.size > 0:
-            df = df.copy()
-            df.columns = [tidy_text(c) for c in df.columns]
-            for c in df.columns:
-                df[c] = df[c].map(tidy_text)
-            clean.append(df)
+            # sin df.copy(): el frame limpio se arma con las columnas nuevas (object)
+            # en vez de pisar in-place columnas float/int con texto
+            cols = [tidy_column(df.iloc[:, j]) for j in range(df.shape[1])]
+            out = pd.concat(cols, axis=1, ignore_index=True, copy=False)
+            out.columns = [tidy_text(c) for c in df.columns]
+            clean.append(out)
     return clean
 
-def numbers_in_row_with_positions(cells):
-    out = []
-    for i, c in enumerate(cells):
-        v = to_price(c) if is_price_token(c) else None
-        if v is not None:
-            out.append((i, v))
-    return out
+def classify_frame(df):
+    """Versión vectorizada de classify(): (kinds, vals) por fila para una tabla de celdas ya limpias."""
+    import numpy as np
+    import pandas as pd
+    kinds, vals = [], []
+    for j in range(df.shape[1]):
+        col = df.iloc[:, j].astype(object)
+        text = col.str.contains(LETTERS)
+        price = ~text & col.str.match(PRICE_RE)
+        code = price & col.str.match(CODE_RE)
+        kinds.append(np.select([text, code, price], [T_TEXT, T_CODE, T_PRICE], T_OTHER))
+
+        # misma lógica que to_price(), columna entera de una (mantener en sincronía)
+        s = col.where(price, "").str.replace(" ", "", regex=False)
+        s = s.mask(s.str.fullmatch(THOUSANDS_PAT), s.str.replace(".", "", regex=False))
+        s = s.str.replace(",", ".", regex=False).str.replace(NONDIGIT_RE, "", regex=True)
+        v = pd.to_numeric(s, errors="coerce")
+        vals.append(v.astype(object).where(v >= 1, None))
+    kinds = np.column_stack(kinds).tolist() if kinds else []
+    vals = np.column_stack(vals).tolist() if vals else []
+    return kinds, vals
+
+def tabula_line(cells, kinds, vals):
+    # código en la fila: la primera celda que cumpla CODE_RE
+    code = next((c for c, k in zip(cells, kinds) if k == T_CODE), "")
+    return cells, kinds, vals, code
 
 def parse_tabula(pdf_path):
     dfs = read_all_tables(pdf_path)
@@ -232,135 +503,132 @@ def parse_tabula(pdf_path):
     carried_codes = 0
     rows = []
 
-    last_code, last_code_age = None, 999
-    pending = None
+    # el arrastre de código sí cruza de una tabla a la siguiente; la desc pendiente no
+    carry = (None, 999)
 
     for df in dfs:
-        pending = None
-        for _, r in df.iterrows():
-            total_rows += 1
-            cells = [r[c] for c in df.columns]
-
-            # código en la fila
-            code = ""
-            for c in cells:
-                if CODE_RE.match(c or ""):
-                    code = c
-                    break
-
-            # ¿solo código?
-            only_code_line = (code and all((not has_letters(c) and not is_price_token(c)) or c == code for c in cells))
-            if only_code_line:
-                last_code, last_code_age = code, 0
-                pending = None
-                continue
-
-            # descripción
-            desc_parts = []
-            for c in cells:
-                if c == code:
-                    continue
-                if has_letters(c):
-                    desc_parts.append(c)
-            desc = " ".join(desc_parts).strip()
-
-            # números
-            nums = numbers_in_row_with_positions(cells)
-
-            if not code and last_code is not None and last_code_age <= 2 and desc:
-                code = last_code
-                carried_codes += 1
-
-            if code and desc and nums:
-                unit = extract_unit(desc)
-                desc = re.sub(r"\s+[.,]00\b", "", desc)
-                price = nums[-1][1]
-                rows.append([code, desc, unit, int(round(price))])
-                pending = None
-
-            elif code and desc and not nums:
-                unit = extract_unit(desc)
-                desc = re.sub(r"\s+[.,]00\b", "", desc)
-                pending = (code, desc, unit)
-
-            elif (not desc) and nums and pending:
-                price = nums[0][1]
-                pcode, pdesc, punit = pending
-                rows.append([pcode, pdesc, punit, int(round(price))])
-                pending = None
-                merged += 1
-
-            else:
-                pending = None
+        cells_rows = list(df.itertuples(index=False, name=None))
+        total_rows += len(cells_rows)
+        kinds, vals = classify_frame(df)
+        df_rows, df_merged, df_carried, carry = assemble_rows(
+            (tabula_line(*line) for line in zip(cells_rows, kinds, vals)), carry)
+        rows += df_rows
+        merged += df_merged
+        carried_codes += df_carried
 
-            last_code_age += 1 if last_code is not None else 999
-
-    # dedupe
-    dedup = {}
-    for code, desc, unit, price in rows:
-        dedup[(code, desc)] = [code, desc, unit, price]
-    rows = list(dedup.values())
     print(f"[INFO] tabula: filas={total_rows}, items={len(rows)}, fusionadas={merged}, codigos_arrastrados={carried_codes}, dfs={len(dfs)}")
     return rows
 
+# =================== Post-proceso ===================
+def rows_frame(rows):
+    """Dedupe por (codigo, descripcion) manteniendo el último precio visto y ordena por código numérico + descripción."""
+    import pandas as pd
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df = df.drop_duplicates(["codigo", "descripcion"], keep="last")
+    # tipos ya resueltos del lado cliente: Sheets recibe RAW y no re-parsea
+    df["precio_final"] = df["precio_final"].astype("int64")
+    df["_k"] = pd.to_numeric(df["codigo"], errors="coerce").fillna(10**9).astype("int64")
+    df = df.sort_values(["_k", "descripcion"]).drop(columns="_k")
+    print(f"[INFO] items únicos: {len(df)}")
+    return df
+
 # =================== Sheets ===================
-def write_to_sheet(rows, creds):
+def cell_value(v):
+    # equivalente a valueInputOption=RAW: números como número, el resto como texto literal
+    if isinstance(v, (int, float)):
+        return {"userEnteredValue": {"numberValue": v}}
+    return {"userEnteredValue": {"stringValue": str(v)}}
+
+def update_cells_request(sheet_id, row_index, block):
+    return {"updateCells": {
+        "start": {"sheetId": sheet_id, "rowIndex": row_index, "columnIndex": 0},
+        "rows": [{"values": [cell_value(v) for v in r]} for r in block],
+        "fields": "userEnteredValue",
+    }}
+
+def sheets_client(creds):
+    import gspread
+    return gspread.authorize(creds)
+
+def write_to_sheet(rows, gc):
+    import gspread
     print(f"[INFO] Escribiendo {len(rows)} filas en Google Sheets…")
-    gc = gspread.authorize(creds)
     sh = gc.open_by_key(SPREADSHEET_ID)
+    n_rows = len(rows) + 1  # + encabezado
     try:
         ws = sh.worksheet(SHEET_NAME)
-        ws.clear()
     except gspread.exceptions.WorksheetNotFound:
         ws = sh.add_worksheet(title=SHEET_NAME,
                               rows=str(max(len(rows)+10, 100)),
                               cols="4")
 
-    header = [["codigo","descripcion","presentacion","precio_final"]]
-    ws.update("A1:D1", header)
-
+    # limpieza + tamaño de grilla + valores + formato en un solo spreadsheets.batchUpdate;
+    # sólo se parte en más requests si el payload se acerca al límite de ~10 MB
+    values = [COLUMNS] + rows
+    CHUNK = 20000
+    blocks = [values[i:i+CHUNK] for i in range(0, len(values), CHUNK)]
+
+    reqs = [{"updateCells": {"range": {"sheetId": ws.id}, "fields": "userEnteredValue"}}]
+    if ws.row_count < n_rows:
+        reqs.append({"updateSheetProperties": {
+            "properties": {"sheetId": ws.id, "gridProperties": {"rowCount": n_rows}},
+            "fields": "gridProperties.rowCount",
+        }})
+    reqs.append(update_cells_request(ws.id, 0, blocks[0]))
     if rows:
-        CHUNK = 4000
-        for i in range(0, len(rows), CHUNK):
-            block = rows[i:i+CHUNK]
-            ws.update(f"A{2+i}:D{2+i+len(block)-1}", block)
-        ws.format(f"D2:D{len(rows)+1}",
-                  {"numberFormat": {"type":"NUMBER","pattern":"#,##0"}})
+        reqs.append({"repeatCell": {
+            "range": {"sheetId": ws.id, "startRowIndex": 1, "endRowIndex": n_rows,
+                      "startColumnIndex": 3, "endColumnIndex": 4},
+            "cell": {"userEnteredFormat": {"numberFormat": {"type":"NUMBER","pattern":"#,##0"}}},
+            "fields": "userEnteredFormat.numberFormat",
+        }})
+    sh.batch_update({"requests": reqs})
+
+    for k, block in enumerate(blocks[1:], start=1):
+        sh.batch_update({"requests": [update_cells_request(ws.id, k*CHUNK, block)]})
     print("[INFO] Listo.")
 
 # =================== MAIN ===================
 def main():
-    creds = load_creds()
-    with tempfile.TemporaryDirectory() as tmp:
-        pdf_path = os.path.join(tmp, "lista.pdf")
-        download_pdf(pdf_path)
-
-        # 1) pdfplumber
-        rows = parse_pdfplumber(pdf_path)
-
-        # 2) Fallback con Tabula si quedó corto
-        if len(rows) == 0:
-            print("[WARN] pdfplumber devolvió 0 ítems. Intento con Tabula…")
+    gc = sheets_client(load_creds())  # un solo cliente autorizado por corrida
+    downloaded = download_pdf()
+    if downloaded is None:
+        print("[INFO] Lista sin cambios: no se re-parsea ni se reescribe la hoja.")
+        return
+    pdf_bytes, pdf_meta = downloaded
+
+    # 1) pdfplumber / PyMuPDF, directo desde memoria
+    rows = parse_pdfplumber(pdf_bytes)
+
+    # 2) Fallback con Tabula si quedó corto (tabula-java necesita un archivo)
+    if len(rows) == 0:
+        print("[WARN] pdfplumber devolvió 0 ítems. Intento con Tabula…")
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, "lista.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(pdf_bytes)
             rows = parse_tabula(pdf_path)
 
-        # ordenar por código y descripción
-        def code_key(c):
-            try:
-                return int(c)
-            except Exception:
-                return 10**9
-        rows.sort(key=lambda r: (code_key(r[0]), r[1]))
-
-        # artefacto CSV
-        workspace = os.getenv("GITHUB_WORKSPACE", os.getcwd())
-        csv_path = os.path.join(workspace, "proveedor_extracted.csv")
-        pd.DataFrame(rows, columns=["codigo","descripcion","presentacion","precio_final"]).to_csv(
-            csv_path, index=False, encoding="utf-8"
-        )
-        print(f"[INFO] CSV guardado: {csv_path}")
-
-        # escribir
-        write_to_sheet(rows, creds)
+    # sin ítems (fallo de tabula/JVM, cambio de formato): no se vacía la hoja ni se guarda
+    # la metadata, así la próxima corrida vuelve a intentar en vez de saltear por 304/sha256
+    if not rows:
+        raise SystemExit("[ERROR] Ningún parser devolvió ítems: no se actualiza la hoja")
+
+    # dedupe + ordenar por código y descripción
+    rows = rows_frame(rows).values.tolist()
+
+    # artefacto CSV
+    workspace = os.getenv("GITHUB_WORKSPACE", os.getcwd())
+    csv_path = os.path.join(workspace, "proveedor_extracted.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, lineterminator="\n")
+        w.writerow(COLUMNS)
+        w.writerows(rows)
+    print(f"[INFO] CSV guardado: {csv_path}")
+
+    # escribir; la metadata sólo se guarda si la hoja quedó actualizada
+    write_to_sheet(rows, gc)
+    save_pdf_cache(pdf_meta)
 
 if __name__ == "__main__":
     main()